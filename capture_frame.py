@@ -10,32 +10,57 @@ import cv2
 import numpy as np
 import requests
 
+# Grabbing a frame which was already queued by the driver returns almost immediately,
+# waiting for a new frame from the camera takes at least this long.
+FRESH_FRAME_MIN_GRAB_TIME = 0.03
+MAX_GRABS = 5
+
+
+def _read_fresh_frame(cap):
+    # Not all backends honor CAP_PROP_BUFFERSIZE, so drain queued frames until
+    # a grab had to wait for the camera (bounded by MAX_GRABS).
+    for _ in range(MAX_GRABS):
+        start = time.monotonic()
+        if not cap.grab():
+            return False, None
+        if time.monotonic() - start >= FRESH_FRAME_MIN_GRAB_TIME:
+            break
+    return cap.retrieve()
+
 
 # This script captures a frame from a camera, either via OpenCV (if its a digit - camera id) or a URL.
-def capture_frame(camera_id_url):
+# The resolution is only used for OpenCV cameras, for URLs the camera server decides.
+# For URLs a requests.Session can be passed to reuse the connection between captures.
+def capture_frame(camera_id_url, resolution=(1920, 1080), session=None):
     frame = None
 
     if camera_id_url.isdigit():  # If its just a number use opencv
         cap = cv2.VideoCapture(camera_id_url, cv2.CAP_V4L2)
 
-        # Set resolution to 1920x1080
-        cap.set(cv2.CAP_PROP_FRAME_WIDTH, 1920)
-        cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 1080)
+        # Set resolution (default 1920x1080)
+        width, height = resolution
+        cap.set(cv2.CAP_PROP_FRAME_WIDTH, width)
+        cap.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
 
         # Set MJPEG format (if supported by your camera)
         cap.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*"MJPG"))
 
-        ret, frame = cap.read()
+        # Keep only one frame in the driver queue so we don't get a stale image
+        cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+
+        ret, frame = _read_fresh_frame(cap)
         if not ret:  # retry once
             time.sleep(1)
-            ret, frame = cap.read()
+            ret, frame = _read_fresh_frame(cap)
 
         cap.release()
     else:  # Camera ID is a URL, use requests to fetch the image
         try:
-            response = requests.get(camera_id_url, timeout=2)
+            http = session if session is not None else requests
+            response = http.get(camera_id_url, timeout=2)
             response.raise_for_status()
-            img_array = np.asarray(bytearray(response.content), dtype=np.uint8)
+            # View the downloaded bytes directly, imdecode does not need a writable copy
+            img_array = np.frombuffer(response.content, dtype=np.uint8)
             frame = cv2.imdecode(img_array, cv2.IMREAD_COLOR)
         except requests.RequestException as e:
             print(f"Error capturing snapshot from URL: {e}")
@@ -44,8 +69,8 @@ def capture_frame(camera_id_url):
         print(f"Failed to capture frame from camera '{camera_id_url}'")
         return False
 
-    # Flip the image horizontally and vertically
-    frame = cv2.flip(frame, -1)
-    frame = cv2.rotate(frame, cv2.ROTATE_90_COUNTERCLOCKWISE)
+    # Flipping horizontally and vertically followed by a counterclockwise rotation
+    # is the same as a single clockwise rotation
+    frame = cv2.rotate(frame, cv2.ROTATE_90_CLOCKWISE)
 
     return frame
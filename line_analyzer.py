@@ -11,6 +11,9 @@ import cv2
 import matplotlib.pyplot as plt
 import numpy as np
 
+# A single pass with a 9x9 kernel is equivalent to two iterations with a 5x5 kernel
+CLEAN_MASK_KERNEL = cv2.getStructuringElement(cv2.MORPH_RECT, (9, 9))
+
 
 class LineAnalyzer:
     def __init__(self, image, min_blob_area=100, gap_penalty=1000, debug=False):
@@ -20,8 +23,12 @@ class LineAnalyzer:
         self.image = image
         self.mask = None
         self.contours = []
+        self.labels = None
+        self.stats = None
+        self.centroids = None
         self.lines = []
         self.problematic_regions = []
+        self._thickness_matrix = None
 
         self._process_image()
         self._find_contours()
@@ -37,10 +44,11 @@ class LineAnalyzer:
         # Crop 50 pixels from each side to remove rectangle border
         img = self.image[50:-50, 50:-50]
 
-        if img.shape[2] == 4:  # RGBA
-            alpha = img[:, :, 3]
+        if img.ndim == 2 or img.shape[2] == 4:  # Alpha channel only or RGBA
+            alpha = img if img.ndim == 2 else img[:, :, 3]
             self.mask = (alpha > 0).astype(np.uint8) * 255
-            self.image = cv2.cvtColor(img, cv2.COLOR_BGRA2RGB)
+            # Only the debug output needs the color image, it gets converted there
+            self.image = img
         else:
             raise ValueError("Image must have an alpha channel")
 
@@ -55,65 +63,83 @@ class LineAnalyzer:
         Clean the mask to remove thin artifacts.
         """
         # Apply morphological operations to remove thin lines
-        kernel = np.ones((5, 5), np.uint8)
-
         # Opening operation (erosion followed by dilation)
         # This removes small objects and thin lines
-        mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, kernel, iterations=2)
+        mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, CLEAN_MASK_KERNEL)
 
         # Close any small holes in the rectangle
-        mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, kernel, iterations=2)
+        mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, CLEAN_MASK_KERNEL)
 
         return mask
 
     def _find_contours(self):
         contours, _ = cv2.findContours(
-            self.mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_NONE
+            self.mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE
         )
         self.contours = [
             c for c in contours if cv2.contourArea(c) >= self.min_blob_area
         ]
 
+        # Label image of the blobs, used to compute the thickness without
+        # rasterizing the contours again
+        _, self.labels, self.stats, self.centroids = cv2.connectedComponentsWithStats(
+            self.mask, connectivity=8
+        )
+
+    def _blob_id(self, contour):
+        # Each contour belongs to the blob which contains its first point
+        x, y = contour[0, 0]
+        return self.labels[y, x]
+
     def _group_contours_into_lines(self):
         if not self.contours:
             return
 
-        centroids = []
-        for c in self.contours:
-            M = cv2.moments(c)
-            cy = M["m01"] / M["m00"] if M["m00"] else c[0][0][1]
-            centroids.append(cy)
-
-        sorted_contours = sorted(zip(self.contours, centroids), key=lambda x: x[1])
-        lines = []
-        current_line = []
+        # The blob centroids are already known from the connected components
+        blob_ids = [self._blob_id(c) for c in self.contours]
+        centroids = self.centroids[blob_ids, 1]
         y_threshold = self.image.shape[0] * 0.02
 
-        for c, cy in sorted_contours:
-            if current_line and abs(cy - current_line[-1][1]) > y_threshold:
-                lines.append([cnt for cnt, _ in current_line])
-                current_line = []
-            current_line.append((c, cy))
-        if current_line:
-            lines.append([cnt for cnt, _ in current_line])
+        # A new line starts wherever the gap to the previous centroid is too large
+        order = np.argsort(centroids, kind="stable")
+        breaks = np.flatnonzero(np.diff(centroids[order]) > y_threshold) + 1
+        lines = [[self.contours[i] for i in group] for group in np.split(order, breaks)]
 
         self.lines = lines[::-1]
 
     def _compute_thickness_profiles(self):
-        h, w = self.mask.shape
+        w = self.mask.shape[1]
+        # The thickness of each line is written into a row of this matrix and the
+        # per column buffers are reused for all lines
+        self._thickness_matrix = np.zeros((len(self.lines), w))
+        any_col = np.empty(w, dtype=bool)
+        top = np.empty(w, dtype=np.intp)
+        bot = np.empty(w, dtype=np.intp)
         for line_idx in range(len(self.lines)):
-            thickness = np.zeros(w)
             line_contours = self.lines[line_idx]
 
-            combined_mask = np.zeros((h, w), dtype=np.uint8)
-            for cnt in line_contours:
-                cv2.drawContours(combined_mask, [cnt], -1, 255, -1)
-
-            for x in range(w):
-                column = combined_mask[:, x]
-                y_coords = np.where(column > 0)[0]
-                if y_coords.size > 0:
-                    thickness[x] = y_coords.ptp() + 1
+            blob_ids = [self._blob_id(cnt) for cnt in line_contours]
+            blob_stats = self.stats[blob_ids]
+            # Only the rows covered by the blobs of this line need to be scanned
+            y_min = blob_stats[:, cv2.CC_STAT_TOP].min()
+            y_max = (
+                blob_stats[:, cv2.CC_STAT_TOP] + blob_stats[:, cv2.CC_STAT_HEIGHT]
+            ).max()
+            line_mask = np.isin(self.labels[y_min:y_max], blob_ids)
+            h = line_mask.shape[0]
+
+            # Thickness per column is the distance between the first and the
+            # last set pixel, computed for all columns at once
+            line_mask.any(axis=0, out=any_col)
+            line_mask.argmax(axis=0, out=top)
+            flipped = np.ascontiguousarray(line_mask[::-1])
+            flipped.argmax(axis=0, out=bot)
+            # (h - 1 - bot) - top + 1, bot being the first set pixel from below
+            np.subtract(h, bot, out=bot)
+            np.subtract(bot, top, out=bot)
+
+            thickness = self._thickness_matrix[line_idx]
+            np.copyto(thickness, bot, where=any_col)
 
             self.lines[line_idx] = (line_contours, thickness)
 
@@ -125,45 +151,63 @@ class LineAnalyzer:
         standard deviation in each half is considered the problematic area. A region around
         that x position (expanded by region_size) is then marked as problematic.
         """
+        if not self.lines:
+            return
+
         w = self.mask.shape[1]
         region_size = int(w * 0.1)
         problematic_regions = []
+        # The thickness of all lines is stored in a (num_lines, w) matrix so the
+        # standard deviation of every column can be computed in one pass
+        stds = self._thickness_matrix.std(axis=0)
         for half in [slice(0, w // 2), slice(w // 2, w)]:
-            max_std = 0
-            peak = None
-            for x in range(half.start, half.stop):
-                values = []
-                for line in self.lines:
-                    thickness = line[1]
-                    values.append(thickness[x])
-                if values:
-                    column_std = np.std(values)
-                    if column_std > max_std:
-                        max_std = column_std
-                        peak = x
-            if peak is not None:
-                start = max(half.start, peak - region_size)
-                end = min(half.stop, peak + region_size)
-                problematic_regions.append((start, end))
+            half_stds = stds[half]
+            if half_stds.size == 0 or half_stds.max() <= 0:
+                continue
+            peak = half.start + int(np.argmax(half_stds))
+            start = max(half.start, peak - region_size)
+            end = min(half.stop, peak + region_size)
+            problematic_regions.append((start, end))
         self.problematic_regions = problematic_regions[:2]
 
     def _compute_smoothness_metrics(self):
-        for line_idx in range(len(self.lines)):
-            _, thickness = self.lines[line_idx]
+        if not self.lines:
+            return
+
+        T = self._thickness_matrix
+        # The valid mask is computed once and sliced for the problematic regions
+        valid = T > 0
+        std, gaps = self._masked_std_and_gaps(T, valid)
+        s1 = std + gaps * self.gap_penalty
 
-            valid = thickness[thickness > 0]
-            std = np.std(valid) if len(valid) > 1 else 0
-            gaps = np.sum(thickness == 0)
-            s1 = std + gaps * self.gap_penalty
+        s2 = np.zeros(len(self.lines))
+        for start, end in self.problematic_regions:
+            section = slice(start, end + 1)
+            section_std, section_gaps = self._masked_std_and_gaps(
+                T[:, section], valid[:, section]
+            )
+            s2 += section_std + section_gaps * self.gap_penalty
 
-            s2 = 0
-            for start, end in self.problematic_regions:
-                section = thickness[start : end + 1]
-                section_std = np.std(section[section > 0]) if np.any(section > 0) else 0
-                section_gaps = np.sum(section == 0)
-                s2 += section_std + section_gaps * self.gap_penalty
+        for line_idx in range(len(self.lines)):
+            self.lines[line_idx] = (
+                *self.lines[line_idx],
+                float(s1[line_idx]),
+                float(s2[line_idx]),
+            )
 
-            self.lines[line_idx] = (*self.lines[line_idx], s1, s2)
+    @staticmethod
+    def _masked_std_and_gaps(thickness, valid):
+        """
+        Computes for each row the standard deviation of the non zero thickness values
+        and the number of gaps (zero thickness columns).
+        """
+        count = valid.sum(axis=1)
+        divisor = np.maximum(count, 1)
+        # Gaps have a thickness of 0 so they don't contribute to the sum
+        mean = thickness.sum(axis=1) / divisor
+        deviation = np.where(valid, thickness - mean[:, None], 0)
+        std = np.sqrt((deviation**2).sum(axis=1) / divisor)
+        return std, thickness.shape[1] - count
 
     def get_smoothest_lines(self, top=5):
         # sorted_lines = sorted(enumerate(self.lines), key=lambda x: x[1][2])  # Sort by metric over total line
@@ -176,7 +220,10 @@ class LineAnalyzer:
 
     def _debug_output(self):
         plt.figure(figsize=(15, 10))
-        plt.imshow(self.image)
+        if self.image.ndim == 2:
+            plt.imshow(self.image, cmap="gray")
+        else:
+            plt.imshow(cv2.cvtColor(self.image, cv2.COLOR_BGRA2RGB))
 
         top_lines = self.get_smoothest_lines(5)
         best_line = top_lines[0]
@@ -10,12 +10,29 @@ import os
 import time
 
 import cv2
+import requests
 
 from capture_frame import capture_frame
 from line_analyzer import LineAnalyzer
 from retrieve_rect import RetrieveRect
 from segment_image import SegmentImage
 
+
+def parse_resolution(value):
+    """Parse a WIDTHxHEIGHT argument into a (width, height) tuple"""
+    parts = value.lower().split("x")
+    if len(parts) != 2 or not all(part.isdecimal() for part in parts):
+        raise argparse.ArgumentTypeError(
+            f"invalid resolution '{value}', expected WIDTHxHEIGHT e.g. 1920x1080"
+        )
+    width, height = int(parts[0]), int(parts[1])
+    if width <= 0 or height <= 0:
+        raise argparse.ArgumentTypeError(
+            f"invalid resolution '{value}', width and height must be positive"
+        )
+    return width, height
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(
         description="Capture a frame from a camera and find best line."
@@ -24,7 +41,14 @@ if __name__ == "__main__":
         "camera_id", help="Camera ID (integer) or URL to capture the frame from"
     )
     parser.add_argument("num_lines", type=int, help="Number of lines in image")
+    parser.add_argument(
+        "--resolution",
+        type=parse_resolution,
+        default=(1920, 1080),
+        help="Capture resolution WIDTHxHEIGHT (only used for OpenCV camera IDs)",
+    )
     args = parser.parse_args()
+    resolution = args.resolution
 
     image_dir = "images"
     img_file = f"{image_dir}/{int(time.time())}.jpg"
@@ -55,28 +79,34 @@ if __name__ == "__main__":
 
     # Capture the image from the camera - retry sometimes capturing fails
     captured_frame = False
+    session = requests.Session()
     for _ in range(3):
         try:
-            frame = capture_frame(args.camera_id)
+            frame = capture_frame(args.camera_id, resolution, session)
             if frame is not None:
-                cv2.imwrite(img_file, frame)
+                # Encode only once, the JPEG is saved and also sent to the segmenter
+                _, jpg_data = cv2.imencode(".jpg", frame)
+                jpg_data = jpg_data.tobytes()
+                with open(img_file, "wb") as f:
+                    f.write(jpg_data)
                 print(f"Frame captured from camera and saved as {img_file}")
                 captured_frame = True
                 break
         except Exception as e:
             print("Error during capture. Retrying...")
             time.sleep(1)
+    session.close()
     assert captured_frame, "Failed to capture frame"
 
     debug = False
 
     print("Calling SegmentImage")
     segmenter = SegmentImage()
-    seg_img = segmenter.segment(img_file)
+    seg_img = segmenter.segment(img_file, image_data=jpg_data)
 
     print("Calling RetrieveRect")
     retrieve_rect = RetrieveRect(debug=debug)
-    rect_img = retrieve_rect.process_image(seg_img)
+    rect_img = retrieve_rect.process_image(seg_img, alpha_only=True)
 
     print("Calling LineAnalyzer")
     analyzer = LineAnalyzer(rect_img, debug=debug)
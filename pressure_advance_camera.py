@@ -20,6 +20,7 @@ photo_height:           # Height in mm to position the nozzle for photo - for my
 script_path: ~/PressureAdvanceCamera/pa_calibrate.py
 #camera_id: 0           # OpenCV Camera ID or crowsnest url
 camera_id: "http://localhost/webcam/?action=snapshot"
+resolution: 1920x1080   # Capture resolution, only used for OpenCV camera IDs
 x_start: 2              # where to start the pattern
 y_start: 2              # where to start the pattern
 pa_start: 0.0
@@ -34,6 +35,21 @@ speed: 100              # Speed for the fast segments
 bed_mash:               # Name of the bed mesh to load, e.g. "default"
 """
 
+# Result line printed by pa_calibrate.py
+BEST_LINE_RE = re.compile(r"Best line:\s*(\d+)")
+
+# The pattern G-code is executed in chunks of about this many lines
+GCODE_FLUSH_LINES = 512
+
+# One pass of the rectangle outline around the test pattern
+OUTLINE_GCODE = """\
+G1 X{x0:.3f} Y{y0:.3f} F6000 ; Move to inner outline start
+G1 F1200 ; Set moderate speed for outline
+G1 X{x1:.3f} Y{y0:.3f} E{e_width:.5f} ; Inner bottom edge
+G1 X{x1:.3f} Y{y1:.3f} E{e_height:.5f} ; Inner right edge
+G1 X{x0:.3f} Y{y1:.3f} E{e_width:.5f} ; Inner top edge
+G1 X{x0:.3f} Y{y0:.3f} E{e_height:.5f} ; Inner left edge"""
+
 
 class PressureAdvanceCamera:
     def __init__(self, config):
@@ -53,6 +69,13 @@ class PressureAdvanceCamera:
         self.camera_id = config.get(
             "camera_id", "http://localhost/webcam/?action=snapshot"
         )
+        self.resolution = config.get("resolution", "1920x1080").lower()
+        # Checked here as well so a typo is reported when loading the config
+        size = self.resolution.split("x")
+        if len(size) != 2 or not all(val.isdecimal() and int(val) > 0 for val in size):
+            raise config.error(
+                f"Invalid resolution '{self.resolution}', expected WIDTHxHEIGHT"
+            )
         self.camera_offset_x = config.getfloat("camera_offset_x")
         self.camera_offset_y = config.getfloat("camera_offset_y")
         self.photo_height = config.getfloat("photo_height")
@@ -72,7 +95,9 @@ class PressureAdvanceCamera:
 
         # Process handling
         self.proc_fd = None
-        self.partial_output = ""
+        self.proc_done = None
+        self.partial_output = b""
+        self.full_output_chunks = []
         self.full_output = ""
 
         # Save test pattern params used in the last run for later analysis
@@ -93,23 +118,47 @@ class PressureAdvanceCamera:
     def _process_output(self, eventime):
         if self.proc_fd is None:
             return
-        try:
-            data = os.read(self.proc_fd, 4096)
-        except Exception:
-            return
-        data = self.partial_output + data.decode()
-        self.full_output += data
+        # The fd is non blocking, read everything available in this wakeup
+        chunks = []
+        eof = False
+        while True:
+            try:
+                data = os.read(self.proc_fd, 65536)
+            except BlockingIOError:
+                break
+            except Exception:
+                # Nothing more can be read, handle it like EOF so the command
+                # doesn't wait for the timeout, the exit code is checked later
+                eof = True
+                break
+            if not data:
+                eof = True
+                break
+            chunks.append(data)
+
+        if chunks:
+            self._respond_output(b"".join(chunks))
+
+        if eof:
+            # EOF - the process closed its output because it exited
+            self.proc_fd = None
+            self.proc_done.complete(True)
+
+    def _respond_output(self, data):
+        # Keep the raw chunks, they only get joined once the process finished
+        self.full_output_chunks.append(data)
+        data = self.partial_output + data
 
-        if "\n" not in data:
+        if b"\n" not in data:
             self.partial_output = data
             return
-        elif data[-1] != "\n":
-            split = data.rfind("\n") + 1
+        elif data[-1:] != b"\n":
+            split = data.rfind(b"\n") + 1
             self.partial_output = data[split:]
             data = data[:split]
         else:
-            self.partial_output = ""
-        self.gcode.respond_info(data)
+            self.partial_output = b""
+        self.gcode.respond_info(data.decode(errors="replace"))
 
     cmd_DRAW_PRESSURE_ADVANCE_PATTERN_help = "Draw a pressure advance test pattern"
 
@@ -208,8 +257,8 @@ class PressureAdvanceCamera:
         extrusion_height = round(nozzle_diameter * 0.75, 2)
 
         # Move to start position
-        gcode.append(f"G1 X{x_start} Y{y_start} F6000 ; Move to start position")
-        gcode.append(f"G1 Z{extrusion_height} F1000 ; Move to printing height")
+        gcode.append(f"G1 X{x_start:.3f} Y{y_start:.3f} F6000 ; Move to start position")
+        gcode.append(f"G1 Z{extrusion_height:.3f} F1000 ; Move to printing height")
 
         # Calculate filament cross-sectional area
         filament_area = math.pi * (filament_diameter / 2) ** 2
@@ -226,25 +275,16 @@ class PressureAdvanceCamera:
         # Draw the rectangle outline (twice as thick)
         for offset in [0, extrusion_width]:
             gcode.append(
-                f"G1 X{x_start + offset} Y{y_start + offset} F6000 ; Move to inner outline start"
-            )
-            gcode.append("G1 F1200 ; Set moderate speed for outline")
-
-            # Bottom edge
-            gcode.append(
-                f"G1 X{x_end - offset} Y{y_start + offset} E{(width - 2*offset) * extrusion_rate} ; Inner bottom edge"
-            )
-            # Right edge
-            gcode.append(
-                f"G1 X{x_end - offset} Y{y_end - offset} E{(height - 2*offset) * extrusion_rate} ; Inner right edge"
-            )
-            # Top edge
-            gcode.append(
-                f"G1 X{x_start + offset} Y{y_end - offset} E{(width - 2*offset) * extrusion_rate} ; Inner top edge"
-            )
-            # Left edge
-            gcode.append(
-                f"G1 X{x_start + offset} Y{y_start + offset} E{(height - 2*offset) * extrusion_rate} ; Inner left edge"
+                OUTLINE_GCODE.format_map(
+                    {
+                        "x0": x_start + offset,
+                        "y0": y_start + offset,
+                        "x1": x_end - offset,
+                        "y1": y_end - offset,
+                        "e_width": (width - 2 * offset) * extrusion_rate,
+                        "e_height": (height - 2 * offset) * extrusion_rate,
+                    }
+                )
             )
 
         # Draw test lines with slow-fast-slow pattern
@@ -264,46 +304,51 @@ class PressureAdvanceCamera:
         segment2_extrusion = segment2_length * extrusion_rate
         segment3_extrusion = segment3_length * extrusion_rate
 
-        for i in range(num_lines):
-            current_pa = pa_start + (i * pa_step)
-            y_pos = y_start + (
-                (i + 2) * line_spacing
-            )  # +2 because we want a gap at the start
-
-            # Move to line start
-            gcode.append(f"G1 Z{extrusion_height+0.1} F1000 ; Small Z hop")
-            gcode.append(
-                f"G1 X{x_start+extrusion_width} Y{y_pos} F12000 ; Move to line start"
-            )
-            gcode.append(f"G1 Z{extrusion_height} F1000 ; Back to printing height")
-
-            # Set pressure advance for this line
-            gcode.append(
-                f"SET_PRESSURE_ADVANCE ADVANCE={current_pa:.6f} ; Set PA for line {i}"
-            )
-
+        # These lines are the same for every test line, only format them once
+        zhop_up = f"G1 Z{extrusion_height+0.1:.3f} F1000 ; Small Z hop"
+        zhop_down = f"G1 Z{extrusion_height:.3f} F1000 ; Back to printing height"
+        slow_feed = f"G1 F{slow_speed * 60:.0f} ; Set slow speed"
+        fast_feed = f"G1 F{speed * 60:.0f} ; Set configured speed"
+        x_line_start = x_start + extrusion_width
+        segment1_e = f"{segment1_extrusion:.5f}"
+        segment2_e = f"{segment2_extrusion:.5f}"
+        segment3_e = f"{segment3_extrusion:.5f}"
+
+        # +2 because we want a gap at the start
+        y_positions = [y_start + (i + 2) * line_spacing for i in range(num_lines)]
+        pa_values = [pa_start + i * pa_step for i in range(num_lines)]
+
+        for i, (y_pos, current_pa) in enumerate(zip(y_positions, pa_values)):
             # Draw the test line in segments with different speeds
-            # Segment 1: Slow
-            x_pos1 = x_start + extrusion_width + segment1_length
-            gcode.append(f"G1 F{slow_speed * 60} ; Set slow speed")
-            gcode.append(
-                f"G1 X{x_pos1:.3f} Y{y_pos} E{segment1_extrusion:.5f} ; Line {i}, slow start"
-            )
-
-            # Segment 2: Fast
+            x_pos1 = x_line_start + segment1_length
             x_pos2 = x_pos1 + segment2_length
-            gcode.append(f"G1 F{speed * 60} ; Set configured speed")
-            gcode.append(
-                f"G1 X{x_pos2:.3f} Y{y_pos} E{segment2_extrusion:.5f} ; Line {i}, fast middle"
-            )
-
-            # Segment 3: Slow
             x_pos3 = x_pos2 + segment3_length
-            gcode.append(f"G1 F{slow_speed * 60} ; Set slow speed")
-            gcode.append(
-                f"G1 X{x_pos3} Y{y_pos} E{segment3_extrusion:.5f} ; Line {i}, slow end"
+
+            gcode.extend(
+                (
+                    # Move to line start
+                    zhop_up,
+                    f"G1 X{x_line_start:.3f} Y{y_pos:.3f} F12000 ; Move to line start",
+                    zhop_down,
+                    # Set pressure advance for this line
+                    f"SET_PRESSURE_ADVANCE ADVANCE={current_pa:.6f} ; Set PA for line {i}",
+                    # Segment 1: Slow
+                    slow_feed,
+                    f"G1 X{x_pos1:.3f} Y{y_pos:.3f} E{segment1_e} ; Line {i}, slow start",
+                    # Segment 2: Fast
+                    fast_feed,
+                    f"G1 X{x_pos2:.3f} Y{y_pos:.3f} E{segment2_e} ; Line {i}, fast middle",
+                    # Segment 3: Slow
+                    slow_feed,
+                    f"G1 X{x_pos3:.3f} Y{y_pos:.3f} E{segment3_e} ; Line {i}, slow end",
+                )
             )
 
+            # Execute what we have so far to bound the memory used by large patterns
+            if len(gcode) >= GCODE_FLUSH_LINES:
+                self.gcode.run_script_from_command("\n".join(gcode))
+                gcode.clear()
+
         # Finish up
         gcode.append("G1 E-4 F480 ; Retract filament")
 
@@ -311,7 +356,9 @@ class PressureAdvanceCamera:
         gcode.append("M104 S0 ; turn off temperature")
 
         # move back to bottom right corner to wipe of some of the extra filament
-        gcode.append(f"G1 X{x_end - extrusion_width} Y{y_start - extrusion_width}")
+        gcode.append(
+            f"G1 X{x_end - extrusion_width:.3f} Y{y_start - extrusion_width:.3f}"
+        )
 
         gcode.append("G1 Z40 F1000 ; Move up")
         # gcode.append("G92 E0 ; Reset extruder")
@@ -340,6 +387,9 @@ class PressureAdvanceCamera:
         if num_lines <= 0:
             raise gcmd.error("NUM_LINES must be positive")
 
+        # Collect the moves so they are submitted as a single script
+        gcode = []
+
         # Move extruder to center of pattern for photo
         if (
             "x_start" in self.last_pattern_params
@@ -358,7 +408,7 @@ class PressureAdvanceCamera:
             y_position = max(0, y_center - camera_offset_y)
 
             # Move to center position at photo height
-            self.gcode.run_script_from_command(
+            gcode.append(
                 f"G1 X{x_position} Y{y_position} F6000 ; Move for camera centering"
             )
             gcmd.respond_info(
@@ -368,17 +418,23 @@ class PressureAdvanceCamera:
                 f"Camera position (X:{x_center}, Y:{y_center}) - using offset (X:{camera_offset_x}, Y:{camera_offset_y})"
             )
 
-        self.gcode.run_script_from_command(
-            f"G1 Z{photo_height} F1000 ; Move to photo height"
-        )
+        gcode.append(f"G1 Z{photo_height} F1000 ; Move to photo height")
 
         # Wait for moves to finish
-        self.gcode.run_script_from_command("M400 ; Wait for moves to finish")
+        gcode.append("M400 ; Wait for moves to finish")
+
+        self.gcode.run_script_from_command("\n".join(gcode))
 
         reactor = self.printer.get_reactor()
         try:
             # Launch the process
-            cmd = [self.script_path, str(self.camera_id), str(num_lines)]
+            cmd = [
+                self.script_path,
+                str(self.camera_id),
+                str(num_lines),
+                "--resolution",
+                self.resolution,
+            ]
             gcmd.respond_info(f"Running: '{cmd}'")
             proc = subprocess.Popen(
                 cmd,
@@ -390,20 +446,23 @@ class PressureAdvanceCamera:
 
         # Set up output handling
         self.proc_fd = proc.stdout.fileno()
-        self.full_output = ""
-        self.partial_output = ""
+        os.set_blocking(self.proc_fd, False)
+        self.full_output_chunks = []
+        self.partial_output = b""
+        self.proc_done = reactor.completion()
         hdl = reactor.register_fd(self.proc_fd, self._process_output)
 
-        # Wait for completion or timeout
-        eventtime = reactor.monotonic()
-        endtime = eventtime + self.timeout
-        complete = False
+        # Wait until the output gets closed or timeout
+        endtime = reactor.monotonic() + self.timeout
+        complete = self.proc_done.wait(endtime) is not None
 
-        while eventtime < endtime:
-            eventtime = reactor.pause(eventtime + 0.05)
-            if proc.poll() is not None:
-                complete = True
+        # The output is closed when the process exits, wait for it to be reaped
+        eventtime = reactor.monotonic()
+        while complete and proc.poll() is None:
+            if eventtime >= endtime:
+                complete = False
                 break
+            eventtime = reactor.pause(eventtime + 0.05)
 
         # Clean up
         if not complete:
@@ -411,11 +470,12 @@ class PressureAdvanceCamera:
             gcmd.respond_info("Pressure advance calibration timed out")
 
         if self.partial_output:
-            gcmd.respond_info(self.partial_output)
-            self.partial_output = ""
+            gcmd.respond_info(self.partial_output.decode(errors="replace"))
+            self.partial_output = b""
 
         reactor.unregister_fd(hdl)
         self.proc_fd = None
+        self.proc_done = None
 
         # Check if successful
         if not complete or proc.returncode != 0:
@@ -423,7 +483,9 @@ class PressureAdvanceCamera:
             return
 
         # Parse the output for "Best line: X"
-        match = re.search(r"Best line:\s*(\d+)", self.full_output)
+        self.full_output = b"".join(self.full_output_chunks).decode(errors="replace")
+        self.full_output_chunks = []
+        match = BEST_LINE_RE.search(self.full_output)
         if match:
             best_line = int(match.group(1))
 
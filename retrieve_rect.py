@@ -9,6 +9,9 @@ import cv2
 import matplotlib.pyplot as plt
 import numpy as np
 
+# A single pass with a 17x17 kernel is equivalent to four iterations with a 5x5 kernel
+CLEAN_MASK_KERNEL = cv2.getStructuringElement(cv2.MORPH_RECT, (17, 17))
+
 
 class RetrieveRect:
     def __init__(self, debug=False):
@@ -17,16 +20,20 @@ class RetrieveRect:
         """
         self.debug = debug
 
-    def process_image(self, image):
+    def process_image(self, image, alpha_only=False):
         """
         Process the image to extract and correct the rectangle.
+        If alpha_only is set only the alpha channel of the corrected rectangle is
+        returned (single channel), which is all LineAnalyzer needs.
         """
-        # Create a copy of the image
-        img = image.copy()
+        # The image is never modified so no copy is needed
+        img = np.ascontiguousarray(image)
 
         if img.shape[2] == 4:
             # img = img[:, :, :3]
-            mask = np.any(img > 0, axis=2)
+            # Viewing each BGRA pixel as one 32 bit value is the same as checking
+            # if any channel is set, without a 4 channel intermediate
+            mask = img.view(np.uint32)[:, :, 0] != 0
         else:
             raise ValueError("Image must have an alpha channel")
 
@@ -46,7 +53,11 @@ class RetrieveRect:
         ordered_corners = self._order_corners(corners)
 
         # Correct perspective distortion
-        corrected_img = self._correct_perspective(img, ordered_corners)
+        # Warping a single channel is much cheaper, the debug output needs all of them
+        if alpha_only and not self.debug:
+            corrected_img = self._correct_perspective(img[:, :, 3], ordered_corners)
+        else:
+            corrected_img = self._correct_perspective(img, ordered_corners)
 
         # Display debug info if requested
         if self.debug:
@@ -59,14 +70,12 @@ class RetrieveRect:
         Clean the mask to remove thin artifacts.
         """
         # Apply morphological operations to remove thin lines
-        kernel = np.ones((5, 5), np.uint8)
-
         # Opening operation (erosion followed by dilation)
         # This removes small objects and thin lines
-        mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, kernel, iterations=4)
+        mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, CLEAN_MASK_KERNEL)
 
         # Close any small holes in the rectangle
-        mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, kernel, iterations=4)
+        mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, CLEAN_MASK_KERNEL)
 
         return mask
 
@@ -80,19 +89,21 @@ class RetrieveRect:
         if not contours:
             return None
 
-        # Filter contours by area to ignore small artifacts
-        min_area = 1000
-        valid_contours = [cnt for cnt in contours if cv2.contourArea(cnt) > min_area]
+        # Find the largest contour, computing each area only once
+        areas = [cv2.contourArea(cnt) for cnt in contours]
+        largest_idx = max(range(len(contours)), key=areas.__getitem__)
 
-        if not valid_contours:
+        # Ignore small artifacts
+        min_area = 1000
+        if areas[largest_idx] <= min_area:
             return None
 
-        # Find the largest contour
-        largest_contour = max(valid_contours, key=cv2.contourArea)
+        largest_contour = contours[largest_idx]
 
+        perimeter = cv2.arcLength(largest_contour, True)
         for scale in [0.01, 0.02, 0.03, 0.05, 0.07, 0.1]:
             # Approximate the contour to get the corners
-            epsilon = scale * cv2.arcLength(largest_contour, True)
+            epsilon = scale * perimeter
             corners = cv2.approxPolyDP(largest_contour, epsilon, True)
             if len(corners) == 4:
                 if self.debug:
@@ -105,7 +116,7 @@ class RetrieveRect:
                 print(f"Did not find 4 corners, using minAreaRect")
             rect = cv2.minAreaRect(largest_contour)
             box = cv2.boxPoints(rect)
-            corners = np.int0(box)
+            corners = np.intp(box)
 
         return corners.reshape(-1, 2)
 
@@ -113,16 +124,14 @@ class RetrieveRect:
         """
         Order the corners: top-left, top-right, bottom-right, bottom-left.
         """
-        # Sort corners by y-coordinate (ascending)
-        sorted_by_y = corners[np.argsort(corners[:, 1]), :]
-        # The first two are the top corners, the last two are the bottom corners
-        top_two = sorted_by_y[:2]
-        bottom_two = sorted_by_y[2:]
-
-        # Sort the top corners by x-coordinate to get top-left and top-right
-        top_left, top_right = top_two[np.argsort(top_two[:, 0]), :]
-        # Sort the bottom corners by x-coordinate to get bottom-left and bottom-right
-        bottom_left, bottom_right = bottom_two[np.argsort(bottom_two[:, 0]), :]
+        # The top-left corner has the smallest x + y, the bottom-right the largest.
+        # The top-right corner has the smallest y - x, the bottom-left the largest.
+        s = corners.sum(axis=1)
+        d = np.diff(corners, axis=1).ravel()
+        top_left = corners[np.argmin(s)]
+        bottom_right = corners[np.argmax(s)]
+        top_right = corners[np.argmin(d)]
+        bottom_left = corners[np.argmax(d)]
 
         return np.array(
             [top_left, top_right, bottom_right, bottom_left], dtype="float32"
@@ -5,15 +5,26 @@
 #
 # This file may be distributed under the terms of the GNU GPLv3 license.
 
+import multiprocessing
 import os
 import re
 import sys
+from collections import defaultdict
 
 import cv2
 
 from line_analyzer import LineAnalyzer
 from retrieve_rect import RetrieveRect
 
+# The expected best lines are encoded at the end of the file name, e.g. "gray45_5,6.jpg"
+FILENAME_RE = re.compile(r"_(\d+(?:,\d+)*)\.jpg$", re.IGNORECASE)
+# Checked with a single str.endswith call instead of lowering every file name
+JPG_SUFFIXES = (".jpg", ".JPG")
+# Files written by SegmentImage next to the inputs and directories that never
+# contain test images, both are skipped without further checks
+OUTPUT_SUFFIXES = ("_mask.png", "_out.png", ".hash")
+IGNORE_DIRS = frozenset((".cache", "__pycache__", ".ipynb_checkpoints"))
+
 
 def get_best_line(image_path, debug=False):
     seg_img = cv2.imread(image_path.replace(".jpg", "_out.png"), cv2.IMREAD_UNCHANGED)
@@ -30,7 +41,7 @@ def get_best_line(image_path, debug=False):
         raise ValueError("Image not found")
 
     retrieve_rect = RetrieveRect(debug=debug)
-    rect_img = retrieve_rect.process_image(seg_img)
+    rect_img = retrieve_rect.process_image(seg_img, alpha_only=True)
 
     analyzer = LineAnalyzer(rect_img, debug=debug)
     smoothest = analyzer.get_smoothest_lines()
@@ -38,47 +49,117 @@ def get_best_line(image_path, debug=False):
     return smoothest[0][0]
 
 
+def _parse_expected_values(file):
+    # Fast path for well formed names like "gray45_5,6.jpg", same rules as FILENAME_RE
+    _, sep, tail = file[:-4].rpartition("_")
+    values = tail.split(",")
+    if sep and all(val.isdecimal() for val in values):
+        return tuple(map(int, values))
+
+    m = FILENAME_RE.search(file)
+    if not m:
+        return None
+    return tuple(map(int, m.group(1).split(",")))
+
+
+def _iter_jpgs(root):
+    # os.scandir caches the file type from the directory listing, so this needs
+    # no extra stat calls per entry
+    with os.scandir(root) as it:
+        for entry in it:
+            name = entry.name
+            if name.endswith(OUTPUT_SUFFIXES):
+                continue
+            if entry.is_dir(follow_symlinks=False):
+                if name not in IGNORE_DIRS:
+                    yield from _iter_jpgs(entry.path)
+            elif name.endswith(JPG_SUFFIXES) and entry.is_file():
+                yield entry
+
+
+def _init_worker():
+    # cv2 and the analyzers are already imported with this module, once per
+    # worker. Every core runs its own worker, so keep OpenCV from starting
+    # another thread pool inside each of them.
+    cv2.setNumThreads(1)
+
+
+def _run_one(task):
+    path, expected_values = task
+    try:
+        return path, expected_values, get_best_line(path, debug=False), None
+    except Exception as e:
+        # Only send the message back, exceptions are not always picklable
+        return path, expected_values, None, str(e)
+
+
+def _describe_failure(expected_values, result, error):
+    if error is not None:
+        return f"Exception: {error}"
+    return f"Expected one of {expected_values}, Got: {result}"
+
+
+def _format_failures(failing_tests):
+    # Group the failures by directory, a directory where every failure has the
+    # same expected values and result is collapsed into a single line
+    by_dir = defaultdict(list)
+    for path, expected_values, result, error in failing_tests:
+        dirname, fname = os.path.split(path)
+        by_dir[dirname].append((fname, (expected_values, result, error)))
+
+    lines = []
+    for dirname, failures in by_dir.items():
+        outcomes = {outcome for _, outcome in failures}
+        if len(failures) > 1 and len(outcomes) == 1:
+            lines.append(
+                f"{dirname}: {len(failures)} failures, {_describe_failure(*outcomes.pop())}"
+            )
+            continue
+        lines.append(f"{dirname}:")
+        for fname, outcome in failures:
+            lines.append(f"  {fname} ({_describe_failure(*outcome)})")
+    return lines
+
+
 def main():
     failing_tests = []
-    num_passed_tests = 0
-    pattern = re.compile(r"_(\d+(?:,\d+)*)\.jpg$", re.IGNORECASE)
-    for root, _, files in os.walk("test_data"):
-        for file in files:
-            if file.lower().endswith(".jpg"):
-                path = os.path.join(root, file)
-                m = pattern.search(file)
-                if not m:
-                    print(f"Skipping {path}: filename pattern not matched")
-                    continue
-                expected_values = [int(val) for val in m.group(1).split(",")]
-
-                try:
-                    result = get_best_line(path, debug=False)
-                except Exception as e:
-                    print(f"FAIL: {path} Exception: {e}")
-                    failing_tests.append(f"{path} (Exception: {e})")
-                    continue
-
-                if result in expected_values:
-                    # print(f"PASS: {path} Expected one of {expected_values}, Got: {result}")
-                    num_passed_tests += 1
-                else:
-                    print(
-                        f"FAIL: {path} Expected one of {expected_values}, Got: {result}"
-                    )
-                    failing_tests.append(
-                        f"{path} (Expected one of {expected_values}, Got: {result})"
-                    )
-
-    if failing_tests:
-        print()
-    print("Summary:")
-    print(f"Num tests passed: {num_passed_tests}")
-    print(f"Num tests failed: {len(failing_tests)}")
+    tasks = []
+    for entry in _iter_jpgs("test_data"):
+        expected_values = _parse_expected_values(entry.name)
+        if expected_values is None:
+            print(f"Skipping {entry.path}: filename pattern not matched")
+            continue
+        tasks.append((entry.path, expected_values))
+
+    # The tests are independent, so run them on all cores.
+    # Results are returned in the sorted task order to keep the output stable.
+    tasks.sort()
+    workers = os.cpu_count() or 1
+    chunksize = max(1, len(tasks) // (4 * workers))
+    # Bind the names used per result to locals
+    add_failure = failing_tests.append
+    passed = 0
+    with multiprocessing.Pool(workers, initializer=_init_worker) as pool:
+        for path, expected_values, result, error in pool.imap(
+            _run_one, tasks, chunksize=chunksize
+        ):
+            if error is None and result in expected_values:
+                # print(f"PASS: {path} Expected one of {expected_values}, Got: {result}")
+                passed += 1
+            else:
+                add_failure((path, expected_values, result, error))
+    num_passed_tests = passed
+
+    # Failures are only formatted once all tests are done and written in one go
+    lines = [
+        "Summary:",
+        f"Num tests passed: {num_passed_tests}",
+        f"Num tests failed: {len(failing_tests)}",
+    ]
     if failing_tests:
-        print("\nFailed tests:")
-        for fail in failing_tests:
-            print(fail)
+        lines.append("\nFailed tests:")
+        lines.extend(_format_failures(failing_tests))
+    sys.stdout.write("\n".join(lines) + "\n")
     sys.exit(1 if failing_tests else 0)
 
 
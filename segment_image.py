@@ -4,12 +4,19 @@
 #
 # This file may be distributed under the terms of the GNU GPLv3 license.
 
-import base64
+import hashlib
 import pathlib
+from concurrent.futures import ThreadPoolExecutor
 
 import cv2
 import fal_client
+import numpy as np
 import requests
+from requests.adapters import HTTPAdapter
+
+# Shared session so the result downloads reuse the connection to the server
+_SESSION = requests.Session()
+_SESSION.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=4))
 
 
 class SegmentImage:
@@ -18,16 +25,50 @@ class SegmentImage:
     def __init__(self):
         self.model_path = "fal-ai/birefnet/v2"
 
-    def segment(self, image_path, resolution="2048x2048", refine_foreground=True):
-        """Segment a single image and save the results"""
+    def segment(
+        self,
+        image_path,
+        resolution="2048x2048",
+        refine_foreground=True,
+        image_data=None,
+    ):
+        """Segment a single image and save the results
+
+        image_data can be the already encoded JPEG content of image_path,
+        in this case the file is not read again. The outputs are reused if
+        the same image was segmented with the same settings before.
+        """
 
         assert resolution in ("2048x2048", "1024x1024")
 
-        image_base64 = self._image_to_base64(image_path)
+        if image_data is None:
+            with open(image_path, "rb") as image_file:
+                image_data = image_file.read()
+
+        # The result only depends on the input and the settings, so reuse the
+        # saved output of a previous call with the same arguments
+        key = hashlib.blake2b(image_data, digest_size=16)
+        key.update(f"{self.model_path}:{resolution}:{refine_foreground}".encode())
+        key = key.hexdigest()
+        image_path = pathlib.Path(image_path)
+        hash_path = image_path.with_suffix(".hash")
+        out_path = image_path.with_name(f"{image_path.stem}_out.png")
+        mask_path = image_path.with_name(f"{image_path.stem}_mask.png")
+        if (
+            hash_path.is_file()
+            and hash_path.read_text() == key
+            and out_path.is_file()
+            and mask_path.is_file()
+        ):
+            return cv2.imread(str(out_path), cv2.IMREAD_UNCHANGED)
+        # The outputs get overwritten below, don't trust them if this call fails
+        hash_path.unlink(missing_ok=True)
+
+        image_url = self._upload_image(str(image_path), image_data)
         result = fal_client.subscribe(
             self.model_path,
             arguments={
-                "image_url": image_base64,
+                "image_url": image_url,
                 "model": "General Use (Heavy)",
                 "operating_resolution": resolution,
                 "output_format": "png",
@@ -37,7 +78,9 @@ class SegmentImage:
             with_logs=True,
             on_queue_update=self._on_queue_update,
         )
-        return self._save_result(result, image_path)
+        img = self._save_result(result, image_path)
+        hash_path.write_text(key)
+        return img
 
     def _on_queue_update(self, update):
         """Handle progress updates from the API"""
@@ -45,12 +88,10 @@ class SegmentImage:
             for log in update.logs:
                 print(log["message"])
 
-    def _image_to_base64(self, image_path):
-        """Convert an image to base64 encoded string"""
+    def _upload_image(self, image_path, image_data):
+        """Upload the raw JPEG to the fal storage and return its URL"""
         assert image_path.endswith(".jpg")
-        with open(image_path, "rb") as image_file:
-            encoded_string = base64.b64encode(image_file.read()).decode("utf-8")
-        return f"data:image/jpeg;base64,{encoded_string}"
+        return fal_client.upload(image_data, "image/jpeg")
 
     def _save_result(self, result, image_path):
         """Save resulting mask and processed image to the same directory as input"""
@@ -58,13 +99,29 @@ class SegmentImage:
         base_filename = image_path.stem
         directory = image_path.parent
 
-        for tag, name in (("mask_image", "mask"), ("image", "out")):
-            if result.get(tag) and result[tag].get("url"):
-                img_path = directory / f"{base_filename}_{name}.png"
-                response = requests.get(result[tag]["url"])
-                with open(img_path, "wb") as f:
-                    f.write(response.content)
-                if tag == "image":
-                    img = cv2.imread(str(img_path), cv2.IMREAD_UNCHANGED)
+        futures = {}
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            # Both downloads are independent, so fetch them at the same time
+            for tag, name in (("mask_image", "mask"), ("image", "out")):
+                if result.get(tag) and result[tag].get("url"):
+                    img_path = directory / f"{base_filename}_{name}.png"
+                    futures[tag] = executor.submit(
+                        self._download, result[tag]["url"], img_path
+                    )
+            contents = {tag: future.result() for tag, future in futures.items()}
 
-        return img
+        # Decode the downloaded bytes instead of reading the file back from disk
+        return cv2.imdecode(
+            np.frombuffer(contents["image"], dtype=np.uint8), cv2.IMREAD_UNCHANGED
+        )
+
+    def _download(self, url, path):
+        """Stream the content of url into the file at path and return it"""
+        content = bytearray()
+        with _SESSION.get(url, stream=True) as response:
+            response.raise_for_status()
+            with open(path, "wb") as f:
+                for chunk in response.iter_content(chunk_size=64 * 1024):
+                    f.write(chunk)
+                    content += chunk
+        return content